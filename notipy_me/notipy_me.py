@@ -1,29 +1,78 @@
-from contextlib import ContextDecorator
+from contextlib import ContextDecorator, suppress
 import os
-import json
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from smtplib import SMTP_SSL
+import re
+from functools import lru_cache
+from email.message import EmailMessage
+from email.policy import SMTP
+from smtplib import SMTP_SSL, SMTPException
 from datetime import datetime
 import socket
 import getpass
-from typing import List, Dict, Callable, Tuple, Union
-import humanize
+from typing import List, Dict, Callable, Tuple, Union, TYPE_CHECKING
 import time
-import pandas as pd
-from validators import domain
 from environments_utils import is_stdout_enabled
-from tabulate import tabulate
-from validate_email import validate_email
-from humanize import naturaldelta
 import sys
 import warnings
 from traceback import format_tb
 from userinput import userinput, set_validator, can_start, clear
 
+if TYPE_CHECKING:
+    import pandas as pd
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+_PWD = os.path.dirname(os.path.realpath(__file__))
+_MODELS_DIR = os.path.join(_PWD, "models")
+# Non ASCII bodies are transfer-encoded, as the server may not support 8BITMIME.
+_POLICY = SMTP.clone(cte_type="7bit")
+
+
+@lru_cache(maxsize=None)
+def _read_model(path: str) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+
+@lru_cache(maxsize=None)
+def _merge_models(*paths: str) -> Dict:
+    merged = {}
+    for path in paths:
+        merged.update(loads(_read_model(path)))
+    return merged
+
+
+def _validate_recipients(recipients: str) -> bool:
+    from validate_email import validate_email
+    return all(
+        validate_email(email.strip()) for email in recipients.split(",")
+    )
+
+
+def _compose(subject: str, txt: str, html: str, sender: str, to: str) -> bytes:
+    msg = EmailMessage(policy=_POLICY)
+    msg["Subject"] = subject
+    msg["To"] = to
+    msg["From"] = sender
+    msg.set_content(txt)
+    msg.add_alternative(html, subtype="html")
+    return msg.as_bytes()
+
 
 class Notipy(ContextDecorator):
     __SINGLE_RUN__ = ".single_run"
+    __SECONDS_PER_UNIT__ = {
+        "hours": 60*60,
+        "minutes": 60,
+        "seconds": 1
+    }
+    __REPORT_TAIL__ = 5
+    # Seconds a pooled SMTP connection may stay idle before being replaced,
+    # and seconds any SMTP operation may block before giving up.
+    __SMTP_MAX_IDLE__ = 60
+    __SMTP_TIMEOUT__ = 10
 
     def __init__(
         self,
@@ -34,9 +83,13 @@ class Notipy(ContextDecorator):
         super(Notipy, self).__init__()
         self._enabled = False
         self._task_name = task_name
+        self._smtp = None
+        self._smtp_last_used = None
         if os.path.exists(self.__SINGLE_RUN__) or setup_single_run or can_start("Press CTRL+C to start notipy within {i} seconds..."):
             self._setup(setup_single_run)
         self._report = self._interrupt_txt = self._interrupt_html = None
+        self._reported_rows = 0
+        self._report_tables = None
 
     def _setup(self, setup_single_run: bool = False):
         self._enabled = True
@@ -100,16 +153,18 @@ class Notipy(ContextDecorator):
             always_use_default=self._always_use_default,
             auto_clear=True
         )
-        self._recipients = userinput(
+        recipients = userinput(
             "recipients", default=self._email,
             label="Please insert {name}, separated by a comma",
             cache_path=".notipy",
-            validator=lambda x: all([
-                validate_email(email) for email in x.split(",")
-            ]),
+            validator=_validate_recipients,
             always_use_default=self._always_use_default,
             auto_clear=True
-        ).split(",")
+        )
+        self._recipients = [
+            recipient.strip() for recipient in recipients.split(",")
+        ]
+        self._recipients_header = ", ".join(self._recipients)
         timeouts = {
             "hours": 24,
             "minutes": 30,
@@ -137,6 +192,8 @@ class Notipy(ContextDecorator):
             always_use_default=self._always_use_default,
             auto_clear=True
         ))
+        self._report_timeout_seconds = self._report_timeout * \
+            self.__SECONDS_PER_UNIT__[self._report_timeout_unit]
         self._port = int(userinput(
             "port",
             default=465,
@@ -154,38 +211,85 @@ class Notipy(ContextDecorator):
             always_use_default=self._always_use_default,
             auto_clear=True
         )
+        self._static_info = {
+            "hostname": socket.gethostname(),
+            "username": getpass.getuser(),
+            "pwd": os.getcwd(),
+            "email": self._email,
+            "task_name": self._task_name
+        }
+
+    def _connection(self) -> SMTP_SSL:
+        """Return a logged in SMTP connection, reusing the previous one if still alive."""
+        if self._smtp is not None:
+            # Idle connections may have been silently dropped by a NAT
+            # or firewall, so they are replaced instead of probed.
+            if self._connection_expired():
+                self._close_connection()
+            else:
+                try:
+                    self._smtp.noop()
+                    return self._smtp
+                except (SMTPException, OSError):
+                    self._close_connection()
+        self._smtp = SMTP_SSL(
+            self._smtp_server,
+            self._port,
+            timeout=self.__SMTP_TIMEOUT__
+        )
+        self._smtp.login(self._email, self._password)
+        return self._smtp
+
+    def _connection_expired(self) -> bool:
+        return time.time() - self._smtp_last_used > self.__SMTP_MAX_IDLE__
+
+    def _close_connection(self, graceful: bool = False):
+        """Close the SMTP connection.
+
+        QUIT is sent only when graceful and the connection is still expected
+        to be alive, as waiting for the reply of a dead server would block.
+        """
+        if self._smtp is None:
+            return
+        if graceful and not self._connection_expired():
+            with suppress(SMTPException, OSError):
+                self._smtp.quit()
+        self._smtp.close()
+        self._smtp = None
 
     def _notify(self, subject: str, txt: str, html: str):
         try:
-            server_ssl = SMTP_SSL(self._smtp_server, self._port)
-            server_ssl.login(self._email, self._password)
-            msg = MIMEMultipart('alternative')
-            msg["Subject"] = subject
-            msg["To"] = ", ".join(self._recipients)
-            msg["From"] = self._email
-            msg.attach(MIMEText(txt, 'plain'))
-            msg.attach(MIMEText(html, 'html'))
-            server_ssl.sendmail(msg["From"], self._recipients, msg.as_string())
-            server_ssl.close()
+            server_ssl = self._connection()
+            server_ssl.sendmail(self._email, self._recipients, _compose(
+                subject, txt, html, self._email, self._recipients_header
+            ))
+            self._smtp_last_used = time.time()
+            # When reports are further apart than the idle limit the
+            # connection would expire before being reused anyway.
+            if self._report_timeout_seconds > self.__SMTP_MAX_IDLE__:
+                self._close_connection()
         except Exception:
+            self._close_connection()
             warnings.warn("Unable to send email with subject '{subject}'!".format(
                 subject=subject
             ))
         
 
-    @property
-    def _pwd(self):
-        return os.path.dirname(os.path.realpath(__file__))
+    @staticmethod
+    def _model_path(name: str, ext: str) -> str:
+        return os.path.join(_MODELS_DIR, "{name}.{ext}".format(name=name, ext=ext))
 
-    def _load_model(self, name: str, ext: str):
-        with open("{pwd}/models/{name}.{ext}".format(pwd=self._pwd, name=name, ext=ext), "r") as f:
-            return f.read()
+    @staticmethod
+    def _load_model(name: str, ext: str) -> str:
+        return _read_model(Notipy._model_path(name, ext))
 
-    def _json(self, name: str, ext: str) -> Dict:
-        common = json.loads(self._load_model("common", "json"))
-        generic = json.loads(self._load_model(name, "json"))
-        extension = json.loads(self._load_model(ext, "json"))
-        return {**common, **generic, **extension}
+    @staticmethod
+    def _json(name: str, ext: str) -> Dict:
+        return _merge_models(
+            Notipy._model_path("common", "json"),
+            Notipy._model_path(name, "json"),
+            Notipy._model_path(ext, "json")
+        )
 
     def _start(self):
         self._notify(  # pylint: disable=no-value-for-parameter
@@ -211,42 +315,66 @@ class Notipy(ContextDecorator):
         self._interrupt_txt = "\n".join(format_tb(tb)) + str(value)
         self._interrupt_html = self._interrupt_txt.replace("\n", "<br>")
 
+    def _render_report(self) -> Tuple[str, str]:
+        """Return the report tail rendered as text and html, rendering it only once per report."""
+        if self._report is None:
+            return "", ""
+        if self._report_tables is None:
+            from tabulate import tabulate
+            tail = self._report.tail(self.__REPORT_TAIL__)
+            self._report_tables = (
+                tabulate(tail, tablefmt="pipe", headers="keys"),
+                tail.to_html()
+            )
+        return self._report_tables
+
     def _info(self) -> Dict:
+        from humanize import naturaldelta
+        report_txt, report_html = self._render_report()
         return {
-            "hostname": socket.gethostname(),
-            "username": getpass.getuser(),
-            "pwd": os.getcwd(),
-            "elapsed": humanize.naturaldelta(time.time() - self._start_time),
+            **self._static_info,
+            "elapsed": naturaldelta(time.time() - self._start_time),
             "now": datetime.now().date(),
             "interrupt_txt": "" if self._interrupt_txt is None else self._interrupt_txt,
             "interrupt_html": "" if self._interrupt_html is None else self._interrupt_html,
-            "report_html": "" if self._report is None else self._report.tail().to_html(),
-            "report_txt": "" if self._report is None else tabulate(self._report.tail(), tablefmt="pipe", headers="keys"),
-            "email": self._email,
-            "task_name": self._task_name
+            "report_html": report_html,
+            "report_txt": report_txt
+        }
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _compiled_model(name: str, ext: str) -> Tuple[str, str]:
+        """Return the subject and body format strings of given model."""
+        separator = "\n" if ext == "txt" else "<br>"
+        data = {
+            k: separator.join(v) if isinstance(v, list) else v
+            for k, v in Notipy._json(name, ext).items()
         }
+        # The braces of the basic model, such as the ones of the CSS
+        # rules, must be escaped to survive the call to format.
+        model = Notipy._load_model("basic", ext).replace(
+            "{", "{{").replace("}", "}}")
+        # All the placeholders are replaced in a single pass, trying
+        # the longest ones first so no placeholder shadows another.
+        placeholders = re.compile("|".join(
+            map(re.escape, sorted(data, key=len, reverse=True))
+        ))
+        model = placeholders.sub(lambda match: data[match.group(0)], model)
+        return data["model_subject"], model
 
     def _build_models(self, name: str) -> Tuple[str, str, str]:
         info = self._info()
-        models = []
-        for ext in ("txt", "html"):
-            data = self._json(name, ext)
-            model = self._load_model("basic", ext)
-            for k, v in data.items():
-                if isinstance(v, list):
-                    if ext == "txt":
-                        v = "\n".join(v)
-                    if ext == "html":
-                        v = "<br>".join(v)
-                v = v.format(**info)
-                model = model.replace(k, v)
-                data[k] = v
-            models.append(model)
-        return (data["model_subject"], *models)
+        subject, txt = self._compiled_model(name, "txt")
+        _, html = self._compiled_model(name, "html")
+        return (
+            subject.format(**info),
+            txt.format(**info),
+            html.format(**info)
+        )
 
     def add_report(
         self,
-        report: Union[pd.DataFrame, Dict],
+        report: Union["pd.DataFrame", Dict],
         add_elapsed_time: bool = True
     ):
         """Add given report to the Notipy object to send via email.
@@ -263,6 +391,10 @@ class Notipy(ContextDecorator):
         """
         if not self._enabled:
             return
+        # Pandas and humanize are imported only when needed, as they
+        # noticeably slow down importing notipy_me.
+        import pandas as pd
+        from humanize import naturaldelta
         if isinstance(report, Dict):
             try:
                 report = pd.DataFrame(report)
@@ -276,15 +408,18 @@ class Notipy(ContextDecorator):
 
         self._last_report = time.time()
 
+        # Only the tail of the report is ever sent, so we keep just those
+        # rows, indexed as they would be in the complete report.
+        report = report.set_index(pd.RangeIndex(
+            self._reported_rows, self._reported_rows + len(report)
+        ))
+        self._reported_rows += len(report)
         self._report = (report if self._report is None else pd.concat([
             self._report, report
-        ])).reset_index(drop=True)
-        if time.time() - self._last_sent_report > self._report_timeout*{
-            "hours": 60*60,
-            "minutes": 60,
-            "seconds": 1
-        }[self._report_timeout_unit]:
-            self._last_sent_report = time.time()
+        ])).tail(self.__REPORT_TAIL__)
+        self._report_tables = None
+        if self._last_report - self._last_sent_report > self._report_timeout_seconds:
+            self._last_sent_report = self._last_report
             self._send_report()
 
     def enter(self):
@@ -307,6 +442,7 @@ class Notipy(ContextDecorator):
             self._interruption()
         elif exc_type is None:
             self._completed()
+        self._close_connection(graceful=True)
 
     def __exit__(self, exc_type, exc_val, traceback):
         self.exit(exc_type, exc_val, traceback)
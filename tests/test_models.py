@@ -0,0 +1,60 @@
+import json
+import os
+from notipy_me import Notipy
+import pytest
+
+MODELS = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "notipy_me",
+    "models"
+)
+
+INFO = {
+    "hostname": "host",
+    "username": "user",
+    "pwd": "/path",
+    "email": "a@gmail.com",
+    "task_name": "task",
+    "elapsed": "3 seconds",
+    "now": "2020-01-01",
+    "interrupt_txt": "line\nerror",
+    "interrupt_html": "line<br>error",
+    "report_html": "<table><tr><td>{1}</td></tr></table>",
+    "report_txt": "| a |\n|---|\n| 1 |"
+}
+
+
+def load(name: str, ext: str) -> str:
+    with open(os.path.join(MODELS, "{}.{}".format(name, ext)), "r") as f:
+        return f.read()
+
+
+def expand(name: str):
+    """Expand the models as notipy originally did, one placeholder at a time."""
+    models = []
+    for ext in ("txt", "html"):
+        data = {
+            **json.loads(load("common", "json")),
+            **json.loads(load(name, "json")),
+            **json.loads(load(ext, "json"))
+        }
+        model = load("basic", ext)
+        for k, v in data.items():
+            if isinstance(v, list):
+                v = ("\n" if ext == "txt" else "<br>").join(v)
+            v = v.format(**INFO)
+            model = model.replace(k, v)
+            data[k] = v
+        models.append(model)
+    return (data["model_subject"], *models)
+
+
+@pytest.mark.parametrize("name", ["start", "completed", "interruption", "report"])
+def test_compiled_models(name):
+    subject, txt = Notipy._compiled_model(name, "txt")
+    _, html = Notipy._compiled_model(name, "html")
+    assert (
+        subject.format(**INFO),
+        txt.format(**INFO),
+        html.format(**INFO)
+    ) == expand(name)
@@ -0,0 +1,12 @@
+from notipy_me.notipy_me import _validate_recipients
+from userinput import userinput
+
+
+def test_userinput_rejects_invalid_recipients(monkeypatch):
+    answers = iter(["not-an-email,,", "a@gmail.com"])
+    monkeypatch.setattr("builtins.input", lambda *args: next(answers))
+    assert userinput(
+        "recipients",
+        validator=_validate_recipients,
+        cache=False
+    ) == "a@gmail.com"
@@ -0,0 +1,90 @@
+from smtplib import SMTPServerDisconnected
+import notipy_me.notipy_me as notipy_module
+from notipy_me import Notipy
+import pytest
+
+
+class FakeSMTP:
+    instances = []
+
+    def __init__(self, server, port, timeout=None):
+        self.timeout = timeout
+        self.sent = 0
+        self.noops = 0
+        self.quitted = self.closed = self.dead = False
+        FakeSMTP.instances.append(self)
+
+    def login(self, email, password):
+        pass
+
+    def noop(self):
+        self.noops += 1
+        if self.dead:
+            raise SMTPServerDisconnected()
+
+    def sendmail(self, sender, recipients, msg):
+        self.sent += 1
+
+    def quit(self):
+        self.quitted = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def notipy(monkeypatch):
+    FakeSMTP.instances = []
+    monkeypatch.setattr(notipy_module, "SMTP_SSL", FakeSMTP)
+    monkeypatch.setattr(notipy_module, "can_start", lambda *args: False)
+    nm = Notipy(task_name="test")
+    nm._enabled = True
+    nm._email = nm._recipients_header = "a@gmail.com"
+    nm._recipients = ["a@gmail.com"]
+    nm._password = "password"
+    nm._smtp_server = "smtp.gmail.com"
+    nm._port = 465
+    nm._report_timeout_seconds = 30
+    return nm
+
+
+def test_connection_is_reused(notipy):
+    notipy._notify("subject", "txt", "html")
+    notipy._notify("subject", "txt", "html")
+    assert len(FakeSMTP.instances) == 1
+    smtp = FakeSMTP.instances[0]
+    assert smtp.timeout is not None
+    assert smtp.sent == 2 and smtp.noops == 1
+
+
+def test_expired_connection_is_closed_without_quit(notipy):
+    notipy._notify("subject", "txt", "html")
+    notipy._smtp_last_used -= 61
+    notipy._notify("subject", "txt", "html")
+    old, new = FakeSMTP.instances
+    assert old.closed and not old.quitted and old.noops == 0
+    assert new.sent == 1
+
+
+def test_dead_connection_is_replaced(notipy):
+    notipy._notify("subject", "txt", "html")
+    FakeSMTP.instances[0].dead = True
+    notipy._notify("subject", "txt", "html")
+    old, new = FakeSMTP.instances
+    assert old.closed and not old.quitted
+    assert new.sent == 1
+
+
+def test_no_pooling_with_long_report_timeout(notipy):
+    notipy._report_timeout_seconds = 120
+    notipy._notify("subject", "txt", "html")
+    assert FakeSMTP.instances[0].closed
+    assert notipy._smtp is None
+
+
+def test_connection_is_closed_on_exit(notipy):
+    notipy._notify("subject", "txt", "html")
+    notipy.exit(KeyboardInterrupt)
+    smtp = FakeSMTP.instances[0]
+    assert smtp.quitted and smtp.closed
+    assert notipy._smtp is None